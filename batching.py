@@ -0,0 +1,289 @@
+"""
+Dynamic batching in front of Ollama.
+
+Ollama decodes up to OLLAMA_NUM_PARALLEL requests per loaded model in one
+batch. The scheduler keeps each model's batch full without overfilling it:
+a queued request is admitted as soon as a slot is free, whether that is on
+arrival or when a running request finishes (continuous batching).
+
+Requests are also binned by expected output length, and long generations
+can only take part of the slots, leaving room for short interactive replies.
+
+Ollama already evaluates prompts in chunks of num_batch tokens, interleaved
+with other sequences' decode steps. What it does not do is stop several huge
+prompts from being admitted together, so only one long-prompt request per
+model is let in at a time.
+
+A model's dispatcher thread and its workers only exist while it has queued
+or running requests, so the scheduler holds no threads for idle models.
+
+Interactive chat requests always go first. Latency-tolerant batch requests
+(e.g. title generation) only start once no interactive request has been
+queued for a short idle window, and each class has a queue depth limit
+past which new requests are refused rather than left to time out.
+"""
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+import re
+import threading
+import time
+
+# Length bins, by expected output tokens: short <= 64, medium <= 512, long > 512
+SHORT = 'short'
+MEDIUM = 'medium'
+LONG = 'long'
+LENGTH_BINS = (SHORT, MEDIUM, LONG)
+
+# Priority classes, highest first
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+PRIORITIES = (INTERACTIVE, BATCH)
+
+_SHORT_HINTS = re.compile(
+    r"\b(title|one word|yes or no|true or false|short|brief|concise|"
+    r"one sentence|one line|only respond with)\b",
+    re.IGNORECASE
+)
+_LONG_HINTS = re.compile(
+    r"\b(essays?|articles?|story|stories|report|tutorial|guide|in detail|"
+    r"step[ -]by[ -]step|comprehensive|implement|write (a|an|me)|code|program|script)\b",
+    re.IGNORECASE
+)
+_SHORT_PROMPT_WORDS = 12
+
+# Rough characters per token for prompt size estimates (no model tokenizer here)
+_CHARS_PER_TOKEN = 4
+
+_Request = namedtuple('_Request', 'fn future priority length long_prompt enqueued_at')
+
+
+class QueueFull(Exception):
+    """Raised when a priority class's queue is at its depth limit."""
+
+
+def length_bin(prompt):
+    """Guess the output length bin for a prompt from its wording."""
+    wants_short = _SHORT_HINTS.search(prompt) is not None
+    wants_long = _LONG_HINTS.search(prompt) is not None
+
+    if wants_long:
+        return MEDIUM if wants_short else LONG
+    if wants_short or len(prompt.split()) <= _SHORT_PROMPT_WORDS:
+        return SHORT
+    return MEDIUM
+
+
+def estimate_tokens(messages):
+    """Estimate the prompt size of a messages array in tokens."""
+    return sum(len(msg['content']) for msg in messages) // _CHARS_PER_TOKEN
+
+
+class ModelBatcher:
+    """Priority- and length-binned queues and dispatcher for a single model."""
+
+    def __init__(self, max_batch_size=4, batch_idle=0.05,
+                 max_interactive_queue=64, max_batch_queue=256, on_idle=None):
+        self.max_batch_size = max(1, max_batch_size)
+        # Long generations may hold at most half the slots
+        self.max_long = max(1, self.max_batch_size // 2)
+        self.max_long_prompts = 1
+        self.batch_idle = batch_idle
+        # A limit of 0 would refuse every request, so each class queues at least one
+        self.max_queue = {INTERACTIVE: max(1, max_interactive_queue), BATCH: max(1, max_batch_queue)}
+        self._queues = {
+            (priority, length): deque()
+            for priority in PRIORITIES for length in LENGTH_BINS
+        }
+        self._running = {name: 0 for name in LENGTH_BINS}
+        self._long_prompts = 0
+        self._interactive_idle_since = 0.0
+        self._ready = threading.Condition()
+        self._worker = None
+        # Called with the batcher after its dispatcher exits for lack of work
+        self._on_idle = on_idle
+
+    def submit(self, fn, length=MEDIUM, long_prompt=False, priority=INTERACTIVE):
+        """
+        Queue fn (a zero-argument callable) and return a Future for its result.
+        Raises QueueFull if the priority class is at its queue depth limit.
+        """
+        future = self._enqueue(fn, length, long_prompt, priority)
+        with self._ready:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+        return future
+
+    def queue_depth(self, priority):
+        """Return the number of queued (not yet running) requests in a priority class."""
+        with self._ready:
+            return self._depth(priority)
+
+    def idle(self):
+        """Return True if nothing is queued or running and no dispatcher is alive."""
+        with self._ready:
+            return self._worker is None and self._is_idle()
+
+    def _is_idle(self):
+        return not any(self._queues.values()) and not any(self._running.values())
+
+    def _depth(self, priority):
+        return sum(len(self._queues[(priority, length)]) for length in LENGTH_BINS)
+
+    def _enqueue(self, fn, length, long_prompt=False, priority=INTERACTIVE):
+        future = Future()
+        with self._ready:
+            if self._depth(priority) >= self.max_queue[priority]:
+                raise QueueFull(f"{priority} queue is full")
+            request = _Request(fn, future, priority, length, long_prompt, time.monotonic())
+            self._queues[(priority, length)].append(request)
+            self._ready.notify_all()
+        return future
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.max_batch_size) as executor:
+            while batch := self._collect():
+                for request in batch:
+                    executor.submit(self._execute, request)
+        if self._on_idle is not None:
+            self._on_idle(self)
+
+    def _collect(self):
+        """
+        Block until a request can be admitted, then take every request that
+        can start now. Each one is a separate Ollama call, so there is nothing
+        to gain from waiting for more to arrive. Returns an empty list, and
+        retires the dispatcher, once nothing is queued or running.
+        """
+        with self._ready:
+            while (key := self._next_queue()) is None:
+                if self._is_idle():
+                    self._worker = None
+                    return []
+                self._ready.wait(self._idle_timeout())
+
+            batch = []
+            while key is not None:
+                batch.append(self._take(key))
+                key = self._next_queue()
+
+        return batch
+
+    def _next_queue(self):
+        """
+        Return the (priority, length) queue to serve next: the highest priority
+        class with an admissible request, and within it the bin whose oldest
+        admissible request has waited longest.
+        """
+        for priority in PRIORITIES:
+            candidates = {}
+            for length in LENGTH_BINS:
+                key = (priority, length)
+                index = self._first_admissible(key)
+                if index is not None:
+                    candidates[key] = self._queues[key][index].enqueued_at
+            if candidates:
+                return min(candidates, key=candidates.get)
+        return None
+
+    def _first_admissible(self, key):
+        """Return the queue index of the oldest request in the queue that can start now."""
+        priority, length = key
+        if sum(self._running.values()) >= self.max_batch_size:
+            return None
+        if length == LONG and self._running[LONG] >= self.max_long:
+            return None
+        if priority == BATCH and self._batch_window_remaining() != 0:
+            return None
+        for index, request in enumerate(self._queues[key]):
+            if not request.long_prompt or self._long_prompts < self.max_long_prompts:
+                return index
+        return None
+
+    def _batch_window_remaining(self):
+        """
+        Return 0 if batch requests may start, the seconds until they may if
+        interactive traffic just went idle, or None while interactive requests
+        are queued.
+        """
+        if self._depth(INTERACTIVE):
+            return None
+        return max(self._interactive_idle_since + self.batch_idle - time.monotonic(), 0)
+
+    def _idle_timeout(self):
+        """Return how long the worker may sleep before a waiting batch request could start."""
+        if not self._depth(BATCH):
+            return None
+        return self._batch_window_remaining() or None
+
+    def _take(self, key):
+        queue = self._queues[key]
+        index = self._first_admissible(key)
+        request = queue[index]
+        del queue[index]
+        self._running[request.length] += 1
+        if request.long_prompt:
+            self._long_prompts += 1
+        if request.priority == INTERACTIVE and not self._depth(INTERACTIVE):
+            self._interactive_idle_since = time.monotonic()
+        return request
+
+    def _execute(self, request):
+        try:
+            if request.future.set_running_or_notify_cancel():
+                request.future.set_result(request.fn())
+        except Exception as e:
+            request.future.set_exception(e)
+        finally:
+            with self._ready:
+                self._running[request.length] -= 1
+                if request.long_prompt:
+                    self._long_prompts -= 1
+                self._ready.notify_all()
+
+
+class BatchScheduler:
+    """
+    Routes requests to a ModelBatcher per model, created on first use and
+    dropped again once it goes idle.
+    """
+
+    def __init__(self, max_batch_size=4, batch_idle=0.05,
+                 max_interactive_queue=64, max_batch_queue=256):
+        self.max_batch_size = max_batch_size
+        self.batch_idle = batch_idle
+        self.max_interactive_queue = max_interactive_queue
+        self.max_batch_queue = max_batch_queue
+        self._batchers = {}
+        self._lock = threading.Lock()
+
+    def submit(self, model, fn, length=MEDIUM, long_prompt=False, priority=INTERACTIVE):
+        """Queue fn for model and return a Future for its result."""
+        with self._lock:
+            batcher = self._batchers.get(model)
+            if batcher is None:
+                batcher = ModelBatcher(
+                    self.max_batch_size, self.batch_idle,
+                    self.max_interactive_queue, self.max_batch_queue,
+                    on_idle=partial(self._release, model)
+                )
+                self._batchers[model] = batcher
+            # Submitted under the lock so a batcher is never used after release
+            try:
+                return batcher.submit(fn, length, long_prompt, priority)
+            except QueueFull:
+                # A batcher that never got work would otherwise never be released
+                if batcher.idle():
+                    del self._batchers[model]
+                raise
+
+    def _release(self, model, batcher):
+        """Forget model's batcher if it is still idle once its dispatcher exits."""
+        with self._lock:
+            if self._batchers.get(model) is batcher and batcher.idle():
+                del self._batchers[model]
+
+    def run(self, model, fn, length=MEDIUM, long_prompt=False, priority=INTERACTIVE):
+        """Queue fn for model and block until it completes."""
+        return self.submit(model, fn, length, long_prompt, priority).result()
@@ -0,0 +1,18 @@
+"""
+Gunicorn configuration for production deployments.
+
+Usage:
+    gunicorn server:app
+
+Requests spend almost all of their time waiting on Ollama, so a single
+gevent worker serves many of them concurrently instead of one at a time.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.environ.get('GUNICORN_WORKERS', 1))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+# Streamed and long completions can legitimately take minutes
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 300))
@@ -0,0 +1,44 @@
+"""
+Request schemas, decoded and validated in one pass by msgspec.
+"""
+from typing import Literal
+
+import msgspec
+
+from batching import BATCH, INTERACTIVE
+
+
+class ChatMessage(msgspec.Struct):
+    """A previous conversation message sent as context."""
+    role: str = 'user'
+    content: str = ''
+
+
+class ChatRequest(msgspec.Struct):
+    """Body of POST /api/v1/response."""
+    prompt: str = ''
+    model: str = ''
+    # Anything other than an array of messages is ignored, as before
+    context: list[ChatMessage] | dict | str | float | bool | None = []
+    stream: bool = False
+    no_cache: bool = False
+    priority: Literal[INTERACTIVE, BATCH] = INTERACTIVE
+
+    def to_messages(self):
+        """Return the Ollama messages array: context followed by the prompt."""
+        context = self.context if isinstance(self.context, list) else []
+        messages = [{'role': msg.role, 'content': msg.content} for msg in context]
+        messages.append({'role': 'user', 'content': self.prompt})
+        return messages
+
+
+_chat_request_decoder = msgspec.json.Decoder(ChatRequest)
+
+
+def decode_chat_request(body):
+    """
+    Decode and validate a /api/v1/response body.
+    Raises msgspec.DecodeError for malformed JSON and msgspec.ValidationError
+    for well-formed JSON that does not match the schema.
+    """
+    return _chat_request_decoder.decode(body)
@@ -0,0 +1,178 @@
+"""
+Semantic response cache.
+
+Serves near-duplicate prompts ("what does X do" / "explain X") from earlier
+responses by comparing prompt embeddings instead of exact text.
+"""
+from collections import OrderedDict
+from concurrent.futures import Future
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+def messages_to_text(messages):
+    """Render a messages array as the text that gets embedded."""
+    return "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+
+
+class _Namespace:
+    """Cached entries for a single chat model."""
+
+    def __init__(self):
+        # id -> (vector, response, expires_at), oldest access first
+        self.entries = OrderedDict()
+        self.next_id = 0
+        self._matrix = None
+        self._ids = None
+
+    def invalidate(self):
+        self._matrix = None
+        self._ids = None
+
+    def matrix(self):
+        """Return (ids, stacked vectors), rebuilt only after a change."""
+        if self._matrix is None:
+            self._ids = list(self.entries)
+            self._matrix = np.stack([self.entries[i][0] for i in self._ids])
+        return self._ids, self._matrix
+
+
+class EmbeddingBatcher:
+    """
+    Collects concurrent embedding requests and sends them to Ollama as one
+    batched embed call of up to max_batch_size texts, waiting at most
+    max_wait seconds for a batch to fill.
+    """
+
+    def __init__(self, client, model, max_batch_size=32, max_wait=0.005):
+        self.client = client
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def embed(self, text):
+        """Return the L2-normalized embedding of text, batched with concurrent callers."""
+        future = Future()
+        self._queue.put((text, future))
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+        return future.result()
+
+    def _run(self):
+        while True:
+            self._embed_batch(self._collect())
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _embed_batch(self, batch):
+        try:
+            response = self.client.embed(model=self.model, input=[text for text, _ in batch])
+            vectors = np.asarray(response['embeddings'], dtype=np.float32)
+            if len(vectors) != len(batch):
+                raise ValueError(f"Expected {len(batch)} embeddings, got {len(vectors)}")
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(norms == 0, 1, norms)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+
+class SemanticCache:
+    """
+    Nearest-neighbour cache over L2-normalized prompt embeddings.
+
+    Entries are namespaced by chat model so one model's answers are never
+    served for another. Each namespace is bounded to max_entries (LRU) and
+    entries expire after ttl seconds. Lookup is a brute-force inner product,
+    which equals cosine similarity on normalized vectors.
+    """
+
+    def __init__(self, client, embedding_model='nomic-embed-text', threshold=0.92,
+                 ttl=3600, max_entries=256):
+        self.client = client
+        self.embedding_model = embedding_model
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._namespaces = {}
+        self._lock = threading.Lock()
+        self._embedder = EmbeddingBatcher(client, embedding_model)
+
+    def embed(self, text):
+        """Return the L2-normalized embedding of text."""
+        return self._embedder.embed(text)
+
+    def lookup(self, model, vector):
+        """
+        Return (response, similarity) for the closest cached prompt of model,
+        or None if nothing is at or above the threshold.
+        """
+        with self._lock:
+            namespace = self._namespaces.get(model)
+            if namespace is None:
+                return None
+
+            self._expire(namespace)
+            if not namespace.entries:
+                return None
+
+            ids, matrix = namespace.matrix()
+            if matrix.shape[1] != vector.shape[0]:
+                return None
+
+            scores = matrix @ vector
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            if similarity < self.threshold:
+                return None
+
+            entry_id = ids[best]
+            namespace.entries.move_to_end(entry_id)
+            return namespace.entries[entry_id][1], similarity
+
+    def add(self, model, vector, response):
+        """Store response for the prompt embedding vector under model."""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            namespace = self._namespaces.setdefault(model, _Namespace())
+            namespace.entries[namespace.next_id] = (vector, response, time.monotonic() + self.ttl)
+            namespace.next_id += 1
+            while len(namespace.entries) > self.max_entries:
+                namespace.entries.popitem(last=False)
+            namespace.invalidate()
+
+    def clear(self):
+        """Drop all cached entries."""
+        with self._lock:
+            self._namespaces.clear()
+
+    def _expire(self, namespace):
+        now = time.monotonic()
+        expired = [i for i, (_, _, expires_at) in namespace.entries.items() if expires_at <= now]
+        for entry_id in expired:
+            del namespace.entries[entry_id]
+        if expired:
+            namespace.invalidate()
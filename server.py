@@ -1,17 +1,142 @@
-from flask import Flask, request, jsonify, send_from_directory
-from werkzeug.exceptions import BadRequest
+from flask import Flask, Response, request, jsonify, send_from_directory
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import RequestEntityTooLarge
+from collections import OrderedDict
+from concurrent.futures import Future
 from functools import wraps
+import hashlib
+import httpx
+import msgspec
 import ollama
+import orjson
 import os
+import queue
+import threading
+import time
+
+from batching import INTERACTIVE, MEDIUM, BatchScheduler, QueueFull, estimate_tokens, length_bin
+from schemas import decode_chat_request
+from semantic_cache import SemanticCache, messages_to_text
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider backed by orjson for request parsing and jsonify.
+    Honors Flask's sort_keys and pretty-printing settings like the default
+    provider, accepts non-string dict keys as the stdlib json module does, and
+    sends dates through Flask's default (HTTP date format). Unlike the stdlib,
+    integers beyond 64 bits raise TypeError.
+    """
+    
+    def _options(self, sort_keys=None, indent=None):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys if sort_keys is None else sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+    
+    def dumps(self, obj, **kwargs):
+        option = self._options(kwargs.get('sort_keys'), kwargs.get('indent'))
+        return orjson.dumps(obj, default=kwargs.get('default', self.default), option=option).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self._options(indent=indent) | orjson.OPT_APPEND_NEWLINE),
+            mimetype=self.mimetype
+        )
+
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
+
+# Request body limits: Flask refuses anything above MAX_CONTENT_LENGTH, and
+# endpoints not listed in BODY_LIMITS take no body at all
+MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+
+BODY_LIMITS = {
+    'get_response': MAX_CONTENT_LENGTH,
+}
 
 # Ollama configuration
 OLLAMA_HOST = "http://localhost:11434"
 
+# Shared client so every request reuses pooled keep-alive connections to Ollama
+ollama_client = ollama.Client(
+    host=OLLAMA_HOST,
+    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64)
+)
+
+# How long Ollama keeps a model loaded after a request. While loaded, each
+# parallel slot keeps its KV cache, and a follow-up chat whose messages share a
+# prefix with the previous one skips re-evaluating that prefix
+OLLAMA_KEEP_ALIVE = os.environ.get('OLLAMA_KEEP_ALIVE', '30m')
+
+# Batching configuration: requests per model kept in flight together, how
+# long interactive traffic must be idle before batch-priority requests start,
+# and per-priority queue depth limits
+scheduler = BatchScheduler(
+    max_batch_size=int(os.environ.get('OLLAMA_NUM_PARALLEL', 4)),
+    batch_idle=float(os.environ.get('BATCH_IDLE_MS', 50)) / 1000,
+    max_interactive_queue=int(os.environ.get('MAX_INTERACTIVE_QUEUE', 64)),
+    max_batch_queue=int(os.environ.get('MAX_BATCH_QUEUE', 256))
+)
+
+# Seconds clients are told to wait when a queue is full
+RETRY_AFTER_SECONDS = int(os.environ.get('RETRY_AFTER_SECONDS', 2))
+
+# Streamed responses are sent in chunks of about this many bytes, or sooner
+# if this many seconds have passed since the last chunk
+STREAM_FLUSH_BYTES = int(os.environ.get('STREAM_FLUSH_BYTES', 4096))
+STREAM_FLUSH_INTERVAL = float(os.environ.get('STREAM_FLUSH_MS', 50)) / 1000
+
+# Marks the end of an Ollama stream on the stream_response queue
+_STREAM_END = object()
+
+# Prompts above this many (estimated) tokens are admitted one at a time per model
+LONG_PROMPT_TOKENS = int(os.environ.get('LONG_PROMPT_TOKENS', 2048))
+
 # API Key configuration
 API_KEY = os.environ.get('API_KEY')
 
+# Response cache configuration (exact-match, LRU)
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+# In-flight Ollama calls keyed by cache_key, shared by identical concurrent requests
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+# Models list cache: Ollama's model set only changes on pull/delete
+MODELS_CACHE_TTL = float(os.environ.get('MODELS_CACHE_TTL', 30))
+
+_models_cache = {'models': None, 'etag': None, 'expires_at': 0.0}
+_models_cache_lock = threading.Lock()
+
+# Semantic cache configuration (near-duplicate prompts, opt-in)
+SEMANTIC_CACHE = os.environ.get('SEMANTIC_CACHE', 'False').lower() == 'true'
+
+# Speculative inference: queue the chat before the semantic lookup and only
+# serve cached answers at or above SPECULATIVE_CACHE_THRESHOLD
+SPECULATIVE_INFERENCE = os.environ.get('SPECULATIVE_INFERENCE', 'False').lower() == 'true'
+SPECULATIVE_CACHE_THRESHOLD = float(os.environ.get('SPECULATIVE_CACHE_THRESHOLD', 0.98))
+
+semantic_cache = SemanticCache(
+    ollama_client,
+    embedding_model=os.environ.get('EMBEDDING_MODEL', 'nomic-embed-text'),
+    threshold=float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0.92)),
+    ttl=int(os.environ.get('SEMANTIC_CACHE_TTL', 3600)),
+    max_entries=int(os.environ.get('SEMANTIC_CACHE_SIZE', 256))
+) if SEMANTIC_CACHE else None
+
 
 def require_api_key(f):
     """Decorator to require API key authentication for endpoints."""
@@ -29,6 +154,136 @@ def require_api_key(f):
     return decorated_function
 
 
+def cache_key(model, messages):
+    """Build a stable key for a (model, messages) pair."""
+    payload = orjson.dumps({"model": model, "messages": messages}, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def get_cached_response(key):
+    """Return the cached response content for key, or None on a miss."""
+    with _response_cache_lock:
+        content = _response_cache.get(key)
+        if content is not None:
+            _response_cache.move_to_end(key)
+        return content
+
+
+def set_cached_response(key, content):
+    """Store response content, evicting the least recently used entry when full."""
+    if RESPONSE_CACHE_SIZE <= 0:
+        return
+    with _response_cache_lock:
+        _response_cache[key] = content
+        _response_cache.move_to_end(key)
+        while len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+
+
+def clear_response_cache():
+    """Drop all cached responses."""
+    with _response_cache_lock:
+        _response_cache.clear()
+    if semantic_cache:
+        semantic_cache.clear()
+
+
+def list_models():
+    """Return (model names, ETag) from Ollama, cached for MODELS_CACHE_TTL seconds."""
+    with _models_cache_lock:
+        if _models_cache['models'] is not None and time.monotonic() < _models_cache['expires_at']:
+            return _models_cache['models'], _models_cache['etag']
+    
+    models_response = ollama_client.list()
+    # Immutable, since the same object is served from the cache to every caller
+    models = tuple(model.model for model in models_response.get('models') or ())
+    etag = hashlib.md5(orjson.dumps(models)).hexdigest()
+    
+    with _models_cache_lock:
+        _models_cache.update(models=models, etag=etag, expires_at=time.monotonic() + MODELS_CACHE_TTL)
+    return models, etag
+
+
+def clear_models_cache():
+    """Forget the cached models list."""
+    with _models_cache_lock:
+        _models_cache.update(models=None, etag=None, expires_at=0.0)
+
+
+def embed_for_semantic_cache(messages):
+    """Embed messages for the semantic cache; None if disabled or embedding fails."""
+    if not semantic_cache:
+        return None
+    try:
+        return semantic_cache.embed(messages_to_text(messages))
+    except Exception as e:
+        app.logger.warning(f"Semantic cache disabled for request: {str(e)}")
+        return None
+
+
+def start_chat(key, model, messages, length=MEDIUM, priority=INTERACTIVE, use_cache=True):
+    """
+    Queue an Ollama chat and return a Future for its response content,
+    coalescing identical concurrent requests into one call. The first caller
+    for key queues the chat on the batch scheduler; callers arriving while it
+    is in flight get the same Future and share its result (or exception).
+    With use_cache the response is stored in the exact cache before the call
+    stops being in flight, so an identical request always finds one or the other.
+    """
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future
+        future = Future()
+        _inflight[key] = future
+    
+    def resolve(scheduled):
+        try:
+            content = scheduled.result()['message']['content']
+            if use_cache:
+                set_cached_response(key, content)
+        except Exception as e:
+            with _inflight_lock:
+                _inflight.pop(key, None)
+            future.set_exception(e)
+            return
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        future.set_result(content)
+    
+    long_prompt = estimate_tokens(messages) > LONG_PROMPT_TOKENS
+    try:
+        scheduled = scheduler.submit(model, lambda: ollama_client.chat(
+            model=model,
+            messages=messages,
+            keep_alive=OLLAMA_KEEP_ALIVE
+        ), length, long_prompt, priority)
+    except Exception as e:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        future.set_exception(e)
+        return future
+    
+    scheduled.add_done_callback(resolve)
+    return future
+
+
+@app.before_request
+def reject_oversized_body():
+    """Refuse requests whose declared body exceeds the endpoint's limit before reading it."""
+    if request.endpoint is None or request.content_length is None:
+        return None
+    if request.content_length > BODY_LIMITS.get(request.endpoint, 0):
+        raise RequestEntityTooLarge()
+    return None
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def payload_too_large(e):
+    """Return oversized-body errors as JSON like every other API error."""
+    return jsonify({"error": "Request body too large"}), 413
+
+
 @app.route('/')
 def index():
     """Serve the main HTML page (to be created later)"""
@@ -44,18 +299,21 @@ def get_response():
     {
         "prompt": "user prompt text",
         "model": "model name",
-        "context": [] (optional list of previous messages)
+        "context": [] (optional list of previous messages),
+        "stream": false (optional, stream tokens as NDJSON),
+        "no_cache": false (optional, bypass the response cache),
+        "priority": "interactive" (optional, "batch" for latency-tolerant requests)
     }
     """
     try:
-        data = request.get_json()
+        body = request.get_data()
         
-        if not data:
+        if not body.strip():
             return jsonify({"error": "No JSON data provided"}), 400
         
-        prompt = data.get('prompt')
-        model = data.get('model')
-        context_messages = data.get('context', [])
+        data = decode_chat_request(body)
+        prompt = data.prompt
+        model = data.model
         
         if not prompt:
             return jsonify({"error": "Missing 'prompt' field"}), 400
@@ -63,59 +321,171 @@ def get_response():
         if not model:
             return jsonify({"error": "Missing 'model' field"}), 400
         
-        # Build messages array with context
-        messages = []
+        # Build messages array with context (last 3 messages from conversation
+        # history) followed by the current user prompt
+        messages = data.to_messages()
+        priority = data.priority
+        
+        if data.stream:
+            return stream_response(model, messages, length_bin(prompt), priority)
+        
+        use_cache = not data.no_cache
+        key = cache_key(model, messages)
         
-        # Add context messages (last 3 messages from conversation history)
-        if context_messages and isinstance(context_messages, list):
-            for msg in context_messages:
-                messages.append({
-                    'role': msg.get('role', 'user'),
-                    'content': msg.get('content', '')
-                })
+        if use_cache:
+            cached = get_cached_response(key)
+            if cached is not None:
+                return jsonify({
+                    "response": cached,
+                    "model": model
+                }), 200, {'X-Cache': 'HIT'}
         
-        # Add current user prompt
-        messages.append({
-            'role': 'user',
-            'content': prompt
-        })
+        # With speculative inference the chat is queued before the semantic
+        # lookup, so a cache miss costs no extra latency
+        pending = None
+        if use_cache and semantic_cache and SPECULATIVE_INFERENCE:
+            pending = start_chat(key, model, messages, length_bin(prompt), priority, use_cache)
+        
+        embedding = embed_for_semantic_cache(messages) if use_cache else None
+        if embedding is not None:
+            match = semantic_cache.lookup(model, embedding)
+            threshold = SPECULATIVE_CACHE_THRESHOLD if pending is not None else semantic_cache.threshold
+            if match is not None and match[1] >= threshold:
+                if pending is not None:
+                    # Let the speculative inference finish and refresh the caches;
+                    # start_chat has already stored it in the exact cache
+                    def refresh(finished):
+                        if finished.exception() is None:
+                            semantic_cache.add(model, embedding, finished.result())
+                    pending.add_done_callback(refresh)
+                return jsonify({
+                    "response": match[0],
+                    "model": model
+                }), 200, {'X-Cache': 'SEMANTIC-HIT'}
         
         # Query Ollama with full conversation context
-        response = ollama.chat(
-            model=model,
-            messages=messages
-        )
+        if pending is None:
+            pending = start_chat(key, model, messages, length_bin(prompt), priority, use_cache)
+        content = pending.result()
+        
+        if embedding is not None:
+            semantic_cache.add(model, embedding, content)
         
         return jsonify({
-            "response": response['message']['content'],
+            "response": content,
             "model": model
-        }), 200
+        }), 200, {'X-Cache': 'MISS' if use_cache else 'BYPASS'}
         
-    except BadRequest:
+    except RequestEntityTooLarge as e:
+        return payload_too_large(e)
+    except msgspec.ValidationError as e:
+        return jsonify({"error": f"Invalid request: {str(e)}"}), 400
+    except msgspec.DecodeError:
         return jsonify({"error": "Invalid JSON data provided"}), 400
+    except QueueFull:
+        return jsonify({"error": "Server busy, try again later"}), 503, {'Retry-After': str(RETRY_AFTER_SECONDS)}
     except ollama.ResponseError as e:
         return jsonify({"error": f"Ollama error: {str(e)}"}), 500
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 
+def stream_response(model, messages, length=MEDIUM, priority=INTERACTIVE):
+    """
+    Stream the Ollama completion back as newline-delimited JSON.
+    Each line is {"delta": "..."}; the last line is {"done": true, "model": ...}.
+    Errors raised after streaming has started are sent as {"error": "..."}.
+    The first delta is sent immediately; later lines are flushed every
+    STREAM_FLUSH_BYTES or STREAM_FLUSH_INTERVAL, whichever comes first.
+    Raises QueueFull before any output if the scheduler queue is full.
+    """
+    deltas = queue.Queue()
+    stop = threading.Event()
+    
+    # Runs on the batch scheduler, holding the model's slot until the stream
+    # ends, and feeds deltas to generate() so flushes are not tied to tokens
+    def read_stream():
+        if stop.is_set():
+            # The client went away while the request was still queued
+            return
+        try:
+            stream = ollama_client.chat(
+                model=model,
+                messages=messages,
+                stream=True,
+                keep_alive=OLLAMA_KEEP_ALIVE
+            )
+            for chunk in stream:
+                if stop.is_set():
+                    break
+                deltas.put(chunk['message']['content'])
+            deltas.put(_STREAM_END)
+        except Exception as e:
+            deltas.put(e)
+    
+    def generate():
+        buf = bytearray()
+        last_flush = None
+        try:
+            while True:
+                timeout = None
+                if buf and last_flush is not None:
+                    timeout = max(last_flush + STREAM_FLUSH_INTERVAL - time.monotonic(), 0)
+                try:
+                    item = deltas.get(timeout=timeout)
+                except queue.Empty:
+                    yield bytes(buf)
+                    buf.clear()
+                    last_flush = time.monotonic()
+                    continue
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                if not item:
+                    continue
+                buf += orjson.dumps({"delta": item}, option=orjson.OPT_APPEND_NEWLINE)
+                now = time.monotonic()
+                if (last_flush is None or len(buf) >= STREAM_FLUSH_BYTES
+                        or now - last_flush >= STREAM_FLUSH_INTERVAL):
+                    yield bytes(buf)
+                    buf.clear()
+                    last_flush = now
+            buf += orjson.dumps({"done": True, "model": model}, option=orjson.OPT_APPEND_NEWLINE)
+        except ollama.ResponseError as e:
+            buf += orjson.dumps({"error": f"Ollama error: {str(e)}"}, option=orjson.OPT_APPEND_NEWLINE)
+        except Exception as e:
+            buf += orjson.dumps({"error": f"Server error: {str(e)}"}, option=orjson.OPT_APPEND_NEWLINE)
+        finally:
+            # Stop reading from Ollama if the client went away
+            stop.set()
+        yield bytes(buf)
+    
+    long_prompt = estimate_tokens(messages) > LONG_PROMPT_TOKENS
+    scheduler.submit(model, read_stream, length, long_prompt, priority)
+    return Response(generate(), mimetype='application/x-ndjson', direct_passthrough=True)
+
+
 @app.route('/api/v1/models', methods=['GET'])
 @require_api_key
 def get_models():
     """
     Get list of available models from Ollama.
+    Responses carry an ETag; a matching If-None-Match gets 304 with no body.
     """
     try:
-        # Get list of models from Ollama
-        models_response = ollama.list()
+        models, etag = list_models()
         
-        # Extract model names
-        models = [model.model for model in models_response.get('models', [])]
-        
-        return jsonify({
-            "models": models,
-            "count": len(models)
-        }), 200
+        if etag in request.if_none_match:
+            response = app.response_class(status=304)
+        else:
+            response = jsonify({
+                "models": models,
+                "count": len(models)
+            })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
         
     except ollama.ResponseError as e:
         return jsonify({"error": f"Ollama error: {str(e)}"}), 500
@@ -124,7 +494,7 @@ def get_models():
 
 
 def run_server():
-    """Run the Flask development server"""
+    """Run the Flask development server (use `gunicorn server:app` in production)"""
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('DEBUG', 'True').lower() == 'true'
     
@@ -281,7 +281,8 @@ async function sendMessage() {
             body: JSON.stringify({
                 prompt: prompt,
                 model: selectedModel,
-                context: contextMessages
+                context: contextMessages,
+                stream: true
             })
         });
         
@@ -293,11 +294,9 @@ async function sendMessage() {
             return;
         }
         
-        const data = await response.json();
-        
         if (response.ok) {
             removeLoading(loadingId);
-            addMessage('assistant', data.response);
+            await readStreamedReply(response);
             
             // If this was the first message, generate a title
             if (isFirstMessage) {
@@ -306,6 +305,7 @@ async function sendMessage() {
             
             saveCurrentChat();
         } else {
+            const data = await response.json();
             removeLoading(loadingId);
             addMessage('assistant', `Error: ${data.error || 'Unknown error occurred'}`);
         }
@@ -319,6 +319,37 @@ async function sendMessage() {
     updateSendButton();
 }
 
+// Render a streamed (NDJSON) reply into a new assistant message as tokens arrive
+async function readStreamedReply(response) {
+    const contentDiv = addMessage('assistant', '');
+    const message = currentChat.messages[currentChat.messages.length - 1];
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split('\n');
+        buffered = lines.pop();
+        
+        for (const line of lines) {
+            if (!line) continue;
+            const chunk = JSON.parse(line);
+            if (chunk.error) {
+                message.content += `${message.content ? '\n\n' : ''}Error: ${chunk.error}`;
+            } else if (chunk.delta) {
+                message.content += chunk.delta;
+            }
+        }
+        
+        contentDiv.innerHTML = marked.parse(message.content);
+        scrollToBottom();
+    }
+}
+
 // Generate chat title from first message
 async function generateChatTitle(firstPrompt, model) {
     try {
@@ -328,7 +359,8 @@ async function generateChatTitle(firstPrompt, model) {
             body: JSON.stringify({
                 prompt: `Generate a short, concise title (maximum 6 words) for a conversation that starts with this user question: "${firstPrompt}". Only respond with the title, nothing else.`,
                 model: model,
-                context: []
+                context: [],
+                priority: 'batch'
             })
         });
         
@@ -384,6 +416,7 @@ function addMessage(role, content) {
     chatContainer.appendChild(messageDiv);
     
     scrollToBottom();
+    return contentDiv;
 }
 
 // Show loading indicator
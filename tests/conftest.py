@@ -5,7 +5,17 @@ import pytest
 import ollama
 import os
 from unittest.mock import patch
-from server import app
+from server import app, clear_models_cache, clear_response_cache
+
+
+@pytest.fixture(autouse=True)
+def reset_caches():
+    """Start every test with empty response and models caches."""
+    clear_response_cache()
+    clear_models_cache()
+    yield
+    clear_response_cache()
+    clear_models_cache()
 
 
 @pytest.fixture
@@ -18,18 +28,25 @@ def client():
 
 @pytest.fixture
 def mock_ollama_chat():
-    """Mock ollama.chat function."""
-    with patch('server.ollama.chat') as mock_chat:
+    """Mock the shared Ollama client's chat method."""
+    with patch('server.ollama_client.chat') as mock_chat:
         yield mock_chat
 
 
 @pytest.fixture
 def mock_ollama_list():
-    """Mock ollama.list function."""
-    with patch('server.ollama.list') as mock_list:
+    """Mock the shared Ollama client's list method."""
+    with patch('server.ollama_client.list') as mock_list:
         yield mock_list
 
 
+@pytest.fixture
+def mock_ollama_embed():
+    """Mock the shared Ollama client's embed method."""
+    with patch('server.ollama_client.embed') as mock_embed:
+        yield mock_embed
+
+
 @pytest.fixture
 def mock_ollama_response_error(monkeypatch):
     """Create and patch a mock ResponseError class."""
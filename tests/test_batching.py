@@ -0,0 +1,292 @@
+"""
+Unit tests for the dynamic batching scheduler.
+"""
+import pytest
+import threading
+import time
+from unittest.mock import patch
+from batching import (
+    BATCH, INTERACTIVE, LONG, MEDIUM, SHORT, BatchScheduler, ModelBatcher, QueueFull,
+    estimate_tokens, length_bin
+)
+
+
+class TestLengthBin:
+    """Tests for the expected output length heuristic."""
+
+    @pytest.mark.parametrize('prompt, expected', [
+        ('What is the capital of France?', SHORT),
+        ('Generate a short, concise title (maximum 6 words) for a conversation that starts with this user question: "How do I bake bread at home without yeast?"', SHORT),
+        ('Write an essay on the history of the Roman Empire', LONG),
+        ('Explain step by step how to set up a Flask project', LONG),
+        ('Write a short story about a cat', MEDIUM),
+        ('I have been reading about transformers and I am curious how attention differs from recurrence in practice', MEDIUM),
+        ('Give me a description of the encoder', SHORT),
+    ])
+    def test_length_bin(self, prompt, expected):
+        assert length_bin(prompt) == expected
+
+
+class TestEstimateTokens:
+    """Tests for prompt size estimates."""
+
+    def test_counts_all_messages(self):
+        messages = [
+            {'role': 'user', 'content': 'A' * 4000},
+            {'role': 'assistant', 'content': 'B' * 4000},
+            {'role': 'user', 'content': 'C' * 2000}
+        ]
+        assert estimate_tokens(messages) == 2500
+
+
+class TestModelBatcher:
+    """Tests for per-model dispatch."""
+
+    def test_returns_result(self):
+        """Test that submit resolves to the callable's return value."""
+        batcher = ModelBatcher(max_batch_size=2)
+        assert batcher.submit(lambda: 'done').result(timeout=5) == 'done'
+
+    def test_propagates_exception(self):
+        """Test that exceptions from the callable are raised from the future."""
+        batcher = ModelBatcher(max_batch_size=2)
+
+        def fail():
+            raise ValueError('boom')
+
+        with pytest.raises(ValueError, match='boom'):
+            batcher.submit(fail).result(timeout=5)
+
+    def test_runs_batch_concurrently(self):
+        """Test that requests queued together run at the same time."""
+        batcher = ModelBatcher(max_batch_size=3)
+        barrier = threading.Barrier(3, timeout=5)
+
+        futures = [batcher.submit(lambda: barrier.wait() is not None) for _ in range(3)]
+
+        assert [f.result(timeout=5) for f in futures] == [True, True, True]
+
+    def test_limits_requests_in_flight(self):
+        """Test that no more than max_batch_size requests run at once."""
+        batcher = ModelBatcher(max_batch_size=2)
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+        release = threading.Event()
+
+        def work():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            release.wait(timeout=5)
+            with lock:
+                running[0] -= 1
+
+        futures = [batcher.submit(work) for _ in range(5)]
+        deadline = time.monotonic() + 5
+        while running[0] < 2 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        time.sleep(0.02)
+        assert peak[0] == 2
+        assert not futures[2].running()
+        release.set()
+        for f in futures:
+            f.result(timeout=5)
+
+        assert peak[0] == 2
+
+    def test_admits_queued_request_when_slot_frees(self):
+        """Test that a queued request starts as soon as one running request finishes."""
+        batcher = ModelBatcher(max_batch_size=2)
+        slow = threading.Event()
+
+        long_running = batcher.submit(lambda: slow.wait(timeout=5))
+        batcher.submit(lambda: 'short').result(timeout=5)
+        queued = batcher.submit(lambda: 'next')
+
+        assert queued.result(timeout=5) == 'next'
+        assert not long_running.done()
+        slow.set()
+        assert long_running.result(timeout=5) is True
+
+    def test_admits_all_free_slots_without_waiting(self):
+        """Test that every request that fits is released at once, oldest bin first."""
+        batcher = ModelBatcher(max_batch_size=2)
+        batcher._enqueue(lambda: None, SHORT)
+        batcher._enqueue(lambda: None, MEDIUM)
+        batcher._enqueue(lambda: None, SHORT)
+
+        assert [request.length for request in batcher._collect()] == [SHORT, MEDIUM]
+        assert batcher.queue_depth(INTERACTIVE) == 1
+
+    def test_idle_request_not_delayed(self):
+        """Test that a request on an idle batcher starts without a batching delay."""
+        scheduler = BatchScheduler(max_batch_size=4)
+        scheduler.run('llama2', lambda: None)
+
+        started = time.monotonic()
+        for _ in range(10):
+            scheduler.run('llama2', lambda: None)
+
+        assert (time.monotonic() - started) / 10 < 0.005
+
+    def test_oldest_bin_served_first(self):
+        """Test that bins are served in arrival order of their oldest request."""
+        batcher = ModelBatcher(max_batch_size=1)
+        batcher._enqueue(lambda: None, LONG)
+        batcher._enqueue(lambda: None, SHORT)
+
+        assert [request.length for request in batcher._collect()] == [LONG]
+
+    def test_long_requests_leave_slots_for_short_ones(self):
+        """Test that long generations cannot occupy every slot."""
+        batcher = ModelBatcher(max_batch_size=4)
+        release = threading.Event()
+
+        long_futures = [batcher.submit(lambda: release.wait(timeout=5), LONG) for _ in range(4)]
+
+        assert batcher.submit(lambda: 'short', SHORT).result(timeout=5) == 'short'
+        assert sum(f.running() for f in long_futures) == 2
+        release.set()
+        for f in long_futures:
+            assert f.result(timeout=5) is True
+
+    def test_one_long_prompt_at_a_time(self):
+        """Test that a second long-prompt request waits while short ones pass it."""
+        batcher = ModelBatcher(max_batch_size=4)
+        release = threading.Event()
+
+        first = batcher.submit(lambda: release.wait(timeout=5), MEDIUM, long_prompt=True)
+        second = batcher.submit(lambda: 'second', MEDIUM, long_prompt=True)
+
+        assert batcher.submit(lambda: 'short', MEDIUM).result(timeout=5) == 'short'
+        assert not second.done()
+        release.set()
+        assert first.result(timeout=5) is True
+        assert second.result(timeout=5) == 'second'
+
+    def test_long_prompt_skipped_within_bin(self):
+        """Test that a blocked long-prompt request does not hold up its bin."""
+        batcher = ModelBatcher(max_batch_size=4)
+        batcher._long_prompts = 1
+        batcher._enqueue(lambda: None, SHORT, long_prompt=True)
+        batcher._enqueue(lambda: None, SHORT)
+
+        batch = batcher._collect()
+
+        assert [request.long_prompt for request in batch] == [False]
+
+
+class TestPriorities:
+    """Tests for interactive/batch priority classes and admission control."""
+
+    def test_interactive_served_before_batch(self):
+        """Test that queued interactive requests go ahead of older batch requests."""
+        batcher = ModelBatcher(max_batch_size=1, batch_idle=0)
+        batcher._enqueue(lambda: None, SHORT, priority=BATCH)
+        batcher._enqueue(lambda: None, SHORT, priority=INTERACTIVE)
+
+        assert [request.priority for request in batcher._collect()] == [INTERACTIVE]
+
+    def test_batch_waits_for_interactive_idle_window(self):
+        """Test that batch requests start only after interactive traffic is idle for batch_idle."""
+        batcher = ModelBatcher(max_batch_size=4, batch_idle=0.05)
+        batcher._enqueue(lambda: None, SHORT, priority=INTERACTIVE)
+        batcher._enqueue(lambda: None, SHORT, priority=BATCH)
+
+        batcher._collect()
+        started = time.monotonic()
+        batch = batcher._collect()
+
+        assert [request.priority for request in batch] == [BATCH]
+        assert time.monotonic() - started >= 0.04
+
+    def test_batch_runs_when_idle(self):
+        """Test that batch requests complete when there is no interactive traffic."""
+        batcher = ModelBatcher(max_batch_size=2, batch_idle=0.01)
+        assert batcher.submit(lambda: 'title', priority=BATCH).result(timeout=5) == 'title'
+
+    def test_queue_full_raises(self):
+        """Test that a priority class refuses new requests past its depth limit."""
+        batcher = ModelBatcher(max_batch_size=1, max_interactive_queue=1, max_batch_queue=1)
+        batcher._enqueue(lambda: None, SHORT, priority=INTERACTIVE)
+
+        with pytest.raises(QueueFull):
+            batcher._enqueue(lambda: None, SHORT, priority=INTERACTIVE)
+        batcher._enqueue(lambda: None, SHORT, priority=BATCH)
+        assert batcher.queue_depth(INTERACTIVE) == 1
+        assert batcher.queue_depth(BATCH) == 1
+
+
+class TestBatchScheduler:
+    """Tests for routing requests to per-model batchers."""
+
+    def test_one_batcher_per_model(self):
+        """Test that each model gets its own batcher."""
+        scheduler = BatchScheduler(max_batch_size=1)
+        release = threading.Event()
+
+        futures = [
+            scheduler.submit(model, lambda: release.wait(timeout=5))
+            for model in ('llama2', 'mistral', 'llama2')
+        ]
+
+        assert set(scheduler._batchers) == {'llama2', 'mistral'}
+        assert scheduler._batchers['llama2'].queue_depth(INTERACTIVE) + futures[0].running() == 2
+        release.set()
+        for f in futures:
+            f.result(timeout=5)
+
+    def test_idle_batchers_release_threads(self):
+        """Test that batchers and their threads go away once their model is idle."""
+        scheduler = BatchScheduler(max_batch_size=2)
+        baseline = threading.active_count()
+
+        futures = [scheduler.submit(f'model-{i}', lambda: None) for i in range(20)]
+        for f in futures:
+            f.result(timeout=5)
+
+        deadline = time.monotonic() + 5
+        while (scheduler._batchers or threading.active_count() > baseline) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert scheduler._batchers == {}
+        assert threading.active_count() <= baseline
+
+    def test_refused_submit_does_not_keep_batcher(self):
+        """Test that a batcher whose first request is refused is not kept."""
+        scheduler = BatchScheduler(max_batch_size=1)
+
+        with patch.object(ModelBatcher, 'submit', side_effect=QueueFull('interactive queue is full')):
+            for i in range(5):
+                with pytest.raises(QueueFull):
+                    scheduler.submit(f'model-{i}', lambda: None)
+
+        assert scheduler._batchers == {}
+
+    def test_zero_queue_limits_clamped(self):
+        """Test that queue limits of 0 still admit one queued request per class."""
+        scheduler = BatchScheduler(max_batch_size=1, max_interactive_queue=0, max_batch_queue=0)
+
+        assert scheduler.run('llama2', lambda: 'ok') == 'ok'
+
+    def test_batcher_reused_after_release(self):
+        """Test that a model gets a working batcher again after its old one was dropped."""
+        scheduler = BatchScheduler(max_batch_size=1)
+        assert scheduler.run('llama2', lambda: 1) == 1
+
+        deadline = time.monotonic() + 5
+        while scheduler._batchers and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        assert scheduler.run('llama2', lambda: 2) == 2
+
+    def test_models_do_not_block_each_other(self):
+        """Test that a busy model does not hold up another model."""
+        scheduler = BatchScheduler(max_batch_size=1)
+        release = threading.Event()
+
+        busy = scheduler.submit('llama2', lambda: release.wait(timeout=5))
+
+        assert scheduler.run('mistral', lambda: 'free') == 'free'
+        release.set()
+        busy.result(timeout=5)
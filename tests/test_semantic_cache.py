@@ -0,0 +1,164 @@
+"""
+Unit tests for the semantic response cache.
+"""
+import pytest
+import threading
+import numpy as np
+from unittest.mock import MagicMock
+from semantic_cache import EmbeddingBatcher, SemanticCache, messages_to_text
+
+
+def unit(*values):
+    """Return a normalized float32 vector."""
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class TestMessagesToText:
+    """Tests for rendering messages as embedding input."""
+
+    def test_renders_role_and_content(self):
+        messages = [
+            {'role': 'user', 'content': 'Hi'},
+            {'role': 'assistant', 'content': 'Hello'}
+        ]
+        assert messages_to_text(messages) == "user: Hi\nassistant: Hello"
+
+
+class TestEmbeddingBatcher:
+    """Tests for batching concurrent embedding requests."""
+
+    def test_concurrent_requests_share_one_call(self):
+        """Test that texts submitted together are embedded in one batched call."""
+        client = MagicMock()
+        client.embed.side_effect = lambda model, input: {
+            'embeddings': [[float(len(text)), 0.0] for text in input]
+        }
+        batcher = EmbeddingBatcher(client, 'nomic-embed-text', max_batch_size=3, max_wait=1)
+        barrier = threading.Barrier(3, timeout=5)
+        results = {}
+
+        def embed(text):
+            barrier.wait()
+            results[text] = batcher.embed(text)
+
+        threads = [threading.Thread(target=embed, args=(text,)) for text in ('a', 'bb', 'ccc')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+
+        client.embed.assert_called_once()
+        assert sorted(client.embed.call_args[1]['input']) == ['a', 'bb', 'ccc']
+        assert all(np.allclose(vector, [1.0, 0.0]) for vector in results.values())
+
+    def test_batch_bounded_by_max_batch_size(self):
+        """Test that no embed call carries more than max_batch_size texts."""
+        client = MagicMock()
+        client.embed.side_effect = lambda model, input: {'embeddings': [[1.0]] * len(input)}
+        batcher = EmbeddingBatcher(client, 'nomic-embed-text', max_batch_size=2, max_wait=0.05)
+        threads = [threading.Thread(target=batcher.embed, args=(str(i),)) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+
+        assert all(len(c[1]['input']) <= 2 for c in client.embed.call_args_list)
+        assert sum(len(c[1]['input']) for c in client.embed.call_args_list) == 5
+
+    def test_error_raised_to_every_caller(self):
+        """Test that a failed embed call fails each request in the batch."""
+        client = MagicMock()
+        client.embed.side_effect = Exception('model not found')
+        batcher = EmbeddingBatcher(client, 'nomic-embed-text', max_wait=0.001)
+
+        with pytest.raises(Exception, match='model not found'):
+            batcher.embed('hello')
+
+    def test_mismatched_response_raises(self):
+        """Test that a response with the wrong number of embeddings does not hang callers."""
+        client = MagicMock()
+        client.embed.return_value = {'embeddings': []}
+        batcher = EmbeddingBatcher(client, 'nomic-embed-text', max_wait=0.001)
+
+        with pytest.raises(ValueError):
+            batcher.embed('hello')
+
+
+class TestSemanticCache:
+    """Tests for SemanticCache lookup, namespacing and eviction."""
+
+    def test_embed_normalizes_vector(self):
+        """Test that embeddings are L2-normalized."""
+        client = MagicMock()
+        client.embed.return_value = {'embeddings': [[3.0, 4.0]]}
+        cache = SemanticCache(client, embedding_model='nomic-embed-text')
+
+        vector = cache.embed('hello')
+
+        assert np.allclose(vector, [0.6, 0.8])
+        assert client.embed.call_args[1]['model'] == 'nomic-embed-text'
+
+    def test_lookup_hit_above_threshold(self):
+        """Test that a near-duplicate embedding returns the stored response."""
+        cache = SemanticCache(MagicMock(), threshold=0.9)
+        cache.add('llama2', unit(1, 0, 0), 'stored')
+
+        match = cache.lookup('llama2', unit(1, 0.1, 0))
+
+        assert match is not None
+        assert match[0] == 'stored'
+        assert match[1] >= 0.9
+
+    def test_lookup_miss_below_threshold(self):
+        """Test that dissimilar embeddings miss."""
+        cache = SemanticCache(MagicMock(), threshold=0.9)
+        cache.add('llama2', unit(1, 0, 0), 'stored')
+
+        assert cache.lookup('llama2', unit(0, 1, 0)) is None
+
+    def test_namespaced_by_model(self):
+        """Test that one model's responses are not served for another."""
+        cache = SemanticCache(MagicMock())
+        cache.add('llama2', unit(1, 0), 'stored')
+
+        assert cache.lookup('mistral', unit(1, 0)) is None
+
+    def test_returns_best_match(self):
+        """Test that the most similar entry wins."""
+        cache = SemanticCache(MagicMock(), threshold=0.5)
+        cache.add('llama2', unit(1, 0), 'first')
+        cache.add('llama2', unit(0.8, 0.6), 'second')
+
+        assert cache.lookup('llama2', unit(0.7, 0.7))[0] == 'second'
+
+    def test_evicts_least_recently_used(self):
+        """Test that each namespace is bounded by max_entries."""
+        cache = SemanticCache(MagicMock(), max_entries=2)
+        cache.add('llama2', unit(1, 0, 0), 'a')
+        cache.add('llama2', unit(0, 1, 0), 'b')
+        cache.lookup('llama2', unit(1, 0, 0))
+        cache.add('llama2', unit(0, 0, 1), 'c')
+
+        assert cache.lookup('llama2', unit(1, 0, 0))[0] == 'a'
+        assert cache.lookup('llama2', unit(0, 1, 0)) is None
+
+    def test_expired_entries_are_dropped(self, monkeypatch):
+        """Test that entries older than ttl are not served."""
+        import semantic_cache
+        now = [1000.0]
+        monkeypatch.setattr(semantic_cache.time, 'monotonic', lambda: now[0])
+        cache = SemanticCache(MagicMock(), ttl=10)
+        cache.add('llama2', unit(1, 0), 'stored')
+
+        now[0] += 11
+
+        assert cache.lookup('llama2', unit(1, 0)) is None
+
+    def test_clear(self):
+        """Test that clear drops all namespaces."""
+        cache = SemanticCache(MagicMock())
+        cache.add('llama2', unit(1, 0), 'stored')
+        cache.clear()
+
+        assert cache.lookup('llama2', unit(1, 0)) is None
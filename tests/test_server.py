@@ -5,7 +5,7 @@ import pytest
 import json
 import os
 from unittest.mock import patch, MagicMock
-from flask import Flask
+from flask import Flask, jsonify
 from server import app
 
 
@@ -52,6 +52,7 @@ class TestResponseEndpoint:
         assert len(call_args[1]['messages']) == 1
         assert call_args[1]['messages'][0]['role'] == 'user'
         assert call_args[1]['messages'][0]['content'] == 'Hello, how are you?'
+        assert call_args[1]['keep_alive'] == '30m'
     
     def test_valid_request_with_context(self, client, mock_ollama_chat, api_headers):
         """Test successful response with conversation context."""
@@ -330,6 +331,657 @@ class TestResponseEndpoint:
         messages = call_args[1]['messages']
         assert len(messages) == 6
 
+    
+    def test_invalid_priority(self, client, api_headers):
+        """Test request with an unknown priority class."""
+        data = {
+            'prompt': 'Hello',
+            'model': 'llama2',
+            'priority': 'urgent'
+        }
+        
+        response = client.post(
+            '/api/v1/response',
+            data=json.dumps(data),
+            content_type='application/json',
+            headers=api_headers
+        )
+        
+        assert response.status_code == 400
+        json_data = json.loads(response.data)
+        assert 'priority' in json_data['error'].lower()
+    
+    def test_non_string_prompt(self, client, api_headers):
+        """Test that schema type errors are reported with the offending field."""
+        data = {
+            'prompt': 123,
+            'model': 'llama2'
+        }
+        
+        response = client.post(
+            '/api/v1/response',
+            data=json.dumps(data),
+            content_type='application/json',
+            headers=api_headers
+        )
+        
+        assert response.status_code == 400
+        json_data = json.loads(response.data)
+        assert 'prompt' in json_data['error'].lower()
+    
+    def test_invalid_context_message(self, client, api_headers):
+        """Test that context entries that are not message objects are rejected."""
+        data = {
+            'prompt': 'Test',
+            'model': 'llama2',
+            'context': ['not a message']
+        }
+        
+        response = client.post(
+            '/api/v1/response',
+            data=json.dumps(data),
+            content_type='application/json',
+            headers=api_headers
+        )
+        
+        assert response.status_code == 400
+        json_data = json.loads(response.data)
+        assert 'context' in json_data['error'].lower()
+    
+    def test_json_array_body(self, client, api_headers):
+        """Test that a JSON body that is not an object is rejected."""
+        response = client.post(
+            '/api/v1/response',
+            data=json.dumps(['Hello']),
+            content_type='application/json',
+            headers=api_headers
+        )
+        
+        assert response.status_code == 400
+    
+    def test_unknown_fields_ignored(self, client, mock_ollama_chat, api_headers):
+        """Test that extra body fields do not fail validation."""
+        mock_ollama_chat.return_value = {'message': {'content': 'Response'}}
+        data = {
+            'prompt': 'Test',
+            'model': 'llama2',
+            'temperature': 0.5
+        }
+        
+        response = client.post(
+            '/api/v1/response',
+            data=json.dumps(data),
+            content_type='application/json',
+            headers=api_headers
+        )
+        
+        assert response.status_code == 200
+    
+    def test_batch_priority_passed_to_scheduler(self, client, mock_ollama_chat, api_headers):
+        """Test that priority is forwarded to the batch scheduler."""
+        import server
+        mock_ollama_chat.return_value = {'message': {'content': 'A title'}}
+        data = {
+            'prompt': 'Generate a title',
+            'model': 'llama2',
+            'priority': 'batch'
+        }
+        
+        with patch.object(server.scheduler, 'submit', wraps=server.scheduler.submit) as submit:
+            response = client.post(
+                '/api/v1/response',
+                data=json.dumps(data),
+                content_type='application/json',
+                headers=api_headers
+            )
+        
+        assert response.status_code == 200
+        assert submit.call_args.args[4] == 'batch'
+    
+    def test_queue_full_returns_503(self, client, api_headers):
+        """Test that a full scheduler queue returns 503 with Retry-After."""
+        import server
+        from batching import QueueFull
+        data = {
+            'prompt': 'Hello',
+            'model': 'llama2'
+        }
+        
+        with patch.object(server.scheduler, 'submit', side_effect=QueueFull('interactive queue is full')):
+            response = client.post(
+                '/api/v1/response',
+                data=json.dumps(data),
+                content_type='application/json',
+                headers=api_headers
+            )
+        
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == str(server.RETRY_AFTER_SECONDS)
+        assert 'busy' in json.loads(response.data)['error'].lower()
+
+
+class TestStreamingResponse:
+    """Tests for streamed /api/v1/response requests."""
+    
+    def _read_lines(self, response):
+        body = b''.join(response.iter_encoded()).decode('utf-8')
+        return [json.loads(line) for line in body.splitlines() if line]
+    
+    def test_stream_yields_deltas(self, client, mock_ollama_chat, api_headers):
+        """Test that stream=true returns one NDJSON line per token."""
+        mock_ollama_chat.return_value = iter([
+            {'message': {'content': 'Hel'}},
+            {'message': {'content': 'lo'}},
+            {'message': {'content': ''}}
+        ])
+        
+        data = {
+            'prompt': 'Hello',
+            'model': 'llama2',
+            'stream': True
+        }
+        
+        response = client.post(
+            '/api/v1/response',
+            data=json.dumps(data),
+            content_type='application/json',
+            headers=api_headers
+        )
+        
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        assert response.content_length is None
+        lines = self._read_lines(response)
+        assert lines == [
+            {'delta': 'Hel'},
+            {'delta': 'lo'},
+            {'done': True, 'model': 'llama2'}
+        ]
+        assert mock_ollama_chat.call_args[1]['stream'] is True
+        assert mock_ollama_chat.call_args[1]['keep_alive'] == '30m'
+    
+    def test_stream_first_delta_sent_alone(self, client, mock_ollama_chat, api_headers):
+        """Test that the first token is flushed immediately and the rest are buffered."""
+        mock_ollama_chat.return_value = iter([
+            {'message': {'content': 'Hel'}},
+            {'message': {'content': 'lo'}}
+        ])
+        
+        response = client.post(
+            '/api/v1/response',
+            data=json.dumps({'prompt': 'Hello', 'model': 'llama2', 'stream': True}),
+            content_type='application/json',
+            headers=api_headers
+        )
+        
+        chunks = list(response.iter_encoded())
+        assert chunks[0] == b'{"delta":"Hel"}\n'
+        assert chunks[1] == b'{"delta":"lo"}\n{"done":true,"model":"llama2"}\n'
+    
+    def test_stream_coalesces_small_deltas(self, client, mock_ollama_chat, api_headers, monkeypatch):
+        """Test that many small tokens are sent in a few large chunks."""
+        import server
+        monkeypatch.setattr(server, 'STREAM_FLUSH_INTERVAL', 60)
+        mock_ollama_chat.return_value = iter([{'message': {'content': 'x'}}] * 1000)
+        
+        response = client.post(
+            '/api/v1/response',
+            data=json.dumps({'prompt': 'Hello', 'model': 'llama2', 'stream': True}),
+            content_type='application/json',
+            headers=api_headers
+        )
+        
+        chunks = list(response.iter_encoded())
+        lines = b''.join(chunks).decode('utf-8').splitlines()
+        assert len(chunks) < 10
+        assert all(len(chunk) >= server.STREAM_FLUSH_BYTES for chunk in chunks[1:-1])
+        assert len(lines) == 1001
+    
+    def test_stream_flushes_during_model_pause(self, client, mock_ollama_chat, api_headers, monkeypatch):
+        """Test that buffered deltas are sent on the flush deadline while the model is paused."""
+        import threading
+        import server
+        monkeypatch.setattr(server, 'STREAM_FLUSH_INTERVAL', 0.01)
+        resume = threading.Event()
+        
+        def chunks():
+            yield {'message': {'content': 'Hel'}}
+            yield {'message': {'content': 'lo'}}
+            resume.wait(timeout=5)
+            yield {'message': {'content': '!'}}
+        
+        mock_ollama_chat.return_value = chunks()
+        
+        response = client.post(
+            '/api/v1/response',
+            data=json.dumps({'prompt': 'Hello', 'model': 'llama2', 'stream': True}),
+            content_type='application/json',
+            headers=api_headers
+        )
+        
+        body = response.iter_encoded()
+        assert next(body) == b'{"delta":"Hel"}\n'
+        assert next(body) == b'{"delta":"lo"}\n'
+        assert not resume.is_set()
+        resume.set()
+        assert b''.join(body) == b'{"delta":"!"}\n{"done":true,"model":"llama2"}\n'
+    
+    def test_stream_goes_through_scheduler(self, client, mock_ollama_chat, api_headers):
+        """Test that streamed chats are queued with their length bin, prompt size and priority."""
+        import server
+        from batching import SHORT
+        mock_ollama_chat.return_value = iter([{'message': {'content': 'Hi'}}])
+        data = {'prompt': 'A' * 10000, 'model': 'llama2', 'stream': True, 'priority': 'batch'}
+        
+        with patch.object(server.scheduler, 'submit', wraps=server.scheduler.submit) as submit:
+            response = client.post(
+                '/api/v1/response',
+                data=json.dumps(data),
+                content_type='application/json',
+                headers=api_headers
+            )
+            lines = self._read_lines(response)
+        
+        assert lines[-1] == {'done': True, 'model': 'llama2'}
+        args = submit.call_args.args
+        assert args[0] == 'llama2'
+        assert args[2:] == (SHORT, True, 'batch')
+    
+    def test_stream_queue_full_returns_503(self, client, api_headers):
+        """Test that a full scheduler queue refuses a stream before it starts."""
+        import server
+        from batching import QueueFull
+        
+        with patch.object(server.scheduler, 'submit', side_effect=QueueFull('interactive queue is full')):
+            response = client.post(
+                '/api/v1/response',
+                data=json.dumps({'prompt': 'Hello', 'model': 'llama2', 'stream': True}),
+                content_type='application/json',
+                headers=api_headers
+            )
+        
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == str(server.RETRY_AFTER_SECONDS)
+    
+    def test_stream_holds_slot_until_done(self, client, mock_ollama_chat, api_headers):
+        """Test that a streamed chat counts against the model's slots until it ends."""
+        import threading
+        import time
+        import server
+        resume = threading.Event()
+        
+        def chunks():
+            yield {'message': {'content': 'Hel'}}
+            resume.wait(timeout=5)
+            yield {'message': {'content': 'lo'}}
+        
+        mock_ollama_chat.return_value = chunks()
+        
+        response = client.post(
+            '/api/v1/response',
+            data=json.dumps({'prompt': 'Hello', 'model': 'llama2', 'stream': True}),
+            content_type='application/json',
+            headers=api_headers
+        )
+        
+        body = response.iter_encoded()
+        assert next(body) == b'{"delta":"Hel"}\n'
+        assert sum(server.scheduler._batchers['llama2']._running.values()) == 1
+        resume.set()
+        b''.join(body)
+        deadline = time.monotonic() + 5
+        while 'llama2' in server.scheduler._batchers and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert 'llama2' not in server.scheduler._batchers
+    
+    def test_stream_error_after_deltas(self, client, mock_ollama_chat, api_headers):
+        """Test that buffered deltas are sent before a mid-stream error line."""
+        def chunks():
+            yield {'message': {'content': 'Hel'}}
+            yield {'message': {'content': 'lo'}}
+            raise Exception('connection lost')
+        
+        mock_ollama_chat.return_value = chunks()
+        
+        response = client.post(
+            '/api/v1/response',
+            data=json.dumps({'prompt': 'Hello', 'model': 'llama2', 'stream': True}),
+            content_type='application/json',
+            headers=api_headers
+        )
+        
+        lines = self._read_lines(response)
+        assert lines[:2] == [{'delta': 'Hel'}, {'delta': 'lo'}]
+        assert 'server' in lines[2]['error'].lower()
+    
+    def test_stream_ollama_error(self, client, mock_ollama_chat, mock_ollama_response_error, api_headers):
+        """Test that Ollama errors during streaming are sent as an error line."""
+        mock_ollama_chat.side_effect = mock_ollama_response_error('Model not found')
+        
+        data = {
+            'prompt': 'Hello',
+            'model': 'nonexistent-model',
+            'stream': True
+        }
+        
+        response = client.post(
+            '/api/v1/response',
+            data=json.dumps(data),
+            content_type='application/json',
+            headers=api_headers
+        )
+        
+        lines = self._read_lines(response)
+        assert len(lines) == 1
+        assert 'ollama' in lines[0]['error'].lower()
+    
+    def test_stream_validation_still_applies(self, client, api_headers):
+        """Test that a streamed request without a prompt is rejected up front."""
+        data = {
+            'model': 'llama2',
+            'stream': True
+        }
+        
+        response = client.post(
+            '/api/v1/response',
+            data=json.dumps(data),
+            content_type='application/json',
+            headers=api_headers
+        )
+        
+        assert response.status_code == 400
+
+
+class TestResponseCache:
+    """Tests for the exact-match response cache on /api/v1/response."""
+    
+    def _post(self, client, headers, **extra):
+        data = {
+            'prompt': 'Hello',
+            'model': 'llama2',
+            'context': [{'role': 'user', 'content': 'Hi'}]
+        }
+        data.update(extra)
+        return client.post(
+            '/api/v1/response',
+            data=json.dumps(data),
+            content_type='application/json',
+            headers=headers
+        )
+    
+    def test_repeat_request_served_from_cache(self, client, mock_ollama_chat, api_headers):
+        """Test that an identical second request does not call Ollama."""
+        mock_ollama_chat.return_value = {'message': {'content': 'Cached reply'}}
+        
+        first = self._post(client, api_headers)
+        second = self._post(client, api_headers)
+        
+        assert first.headers['X-Cache'] == 'MISS'
+        assert second.status_code == 200
+        assert second.headers['X-Cache'] == 'HIT'
+        assert json.loads(second.data)['response'] == 'Cached reply'
+        mock_ollama_chat.assert_called_once()
+    
+    def test_different_model_is_a_miss(self, client, mock_ollama_chat, api_headers):
+        """Test that the cache key includes the model."""
+        mock_ollama_chat.return_value = {'message': {'content': 'Reply'}}
+        
+        self._post(client, api_headers)
+        response = self._post(client, api_headers, model='mistral')
+        
+        assert response.headers['X-Cache'] == 'MISS'
+        assert mock_ollama_chat.call_count == 2
+    
+    def test_no_cache_flag_bypasses_cache(self, client, mock_ollama_chat, api_headers):
+        """Test that no_cache skips both lookup and store."""
+        mock_ollama_chat.return_value = {'message': {'content': 'Reply'}}
+        
+        self._post(client, api_headers)
+        response = self._post(client, api_headers, no_cache=True)
+        
+        assert response.headers['X-Cache'] == 'BYPASS'
+        assert mock_ollama_chat.call_count == 2
+    
+    def test_errors_are_not_cached(self, client, mock_ollama_chat, api_headers):
+        """Test that a failed Ollama call is retried on the next request."""
+        mock_ollama_chat.side_effect = [Exception('boom'), {'message': {'content': 'Reply'}}]
+        
+        assert self._post(client, api_headers).status_code == 500
+        assert self._post(client, api_headers).status_code == 200
+        assert mock_ollama_chat.call_count == 2
+    
+    def test_cache_evicts_least_recently_used(self, client, mock_ollama_chat, api_headers, monkeypatch):
+        """Test that the cache is bounded by RESPONSE_CACHE_SIZE."""
+        import server
+        monkeypatch.setattr(server, 'RESPONSE_CACHE_SIZE', 1)
+        mock_ollama_chat.return_value = {'message': {'content': 'Reply'}}
+        
+        self._post(client, api_headers, prompt='first')
+        self._post(client, api_headers, prompt='second')
+        response = self._post(client, api_headers, prompt='first')
+        
+        assert response.headers['X-Cache'] == 'MISS'
+        assert mock_ollama_chat.call_count == 3
+
+
+class TestSemanticCacheIntegration:
+    """Tests for the semantic cache on /api/v1/response."""
+    
+    @pytest.fixture
+    def semantic_cache(self, monkeypatch):
+        import server
+        from semantic_cache import SemanticCache
+        cache = SemanticCache(server.ollama_client, threshold=0.9)
+        monkeypatch.setattr(server, 'semantic_cache', cache)
+        return cache
+    
+    def _post(self, client, headers, prompt):
+        return client.post(
+            '/api/v1/response',
+            data=json.dumps({'prompt': prompt, 'model': 'llama2'}),
+            content_type='application/json',
+            headers=headers
+        )
+    
+    def test_paraphrase_served_from_semantic_cache(self, client, mock_ollama_chat, mock_ollama_embed, semantic_cache, api_headers):
+        """Test that a near-duplicate prompt is answered without calling Ollama chat."""
+        mock_ollama_chat.return_value = {'message': {'content': 'X does Y'}}
+        mock_ollama_embed.side_effect = [
+            {'embeddings': [[1.0, 0.0]]},
+            {'embeddings': [[1.0, 0.05]]}
+        ]
+        
+        first = self._post(client, api_headers, 'What does X do?')
+        second = self._post(client, api_headers, 'Explain X')
+        
+        assert first.headers['X-Cache'] == 'MISS'
+        assert second.headers['X-Cache'] == 'SEMANTIC-HIT'
+        assert json.loads(second.data)['response'] == 'X does Y'
+        mock_ollama_chat.assert_called_once()
+    
+    @pytest.fixture
+    def speculative(self, monkeypatch, semantic_cache):
+        import server
+        monkeypatch.setattr(server, 'SPECULATIVE_INFERENCE', True)
+        return semantic_cache
+    
+    def _seed(self, client, headers, mock_ollama_chat, mock_ollama_embed):
+        """Answer 'What does X do?' once so the semantic cache holds it."""
+        mock_ollama_chat.return_value = {'message': {'content': 'X does Y'}}
+        mock_ollama_embed.return_value = {'embeddings': [[1.0, 0.0]]}
+        self._post(client, headers, 'What does X do?')
+    
+    def test_speculative_inference_queued_before_lookup(self, client, mock_ollama_chat, mock_ollama_embed, speculative, api_headers):
+        """Test that with speculation on, the chat is queued before the embedding lookup."""
+        import server
+        calls = []
+        mock_ollama_chat.return_value = {'message': {'content': 'Reply'}}
+        mock_ollama_embed.side_effect = lambda **kwargs: calls.append('embed') or {'embeddings': [[1.0, 0.0]]}
+        submit = server.scheduler.submit
+        
+        def recording_submit(*args, **kwargs):
+            calls.append('chat')
+            return submit(*args, **kwargs)
+        
+        with patch.object(server.scheduler, 'submit', side_effect=recording_submit):
+            response = self._post(client, api_headers, 'Hello')
+        
+        assert response.headers['X-Cache'] == 'MISS'
+        assert calls == ['chat', 'embed']
+    
+    def test_speculative_high_confidence_hit_served_from_cache(self, client, mock_ollama_chat, mock_ollama_embed, speculative, api_headers):
+        """Test that a near-identical prompt is served from cache and the inference refreshes the caches."""
+        import time
+        import server
+        self._seed(client, api_headers, mock_ollama_chat, mock_ollama_embed)
+        mock_ollama_chat.return_value = {'message': {'content': 'X does Y and Z'}}
+        mock_ollama_embed.return_value = {'embeddings': [[1.0, 0.01]]}
+        
+        response = self._post(client, api_headers, 'What does X do')
+        
+        assert response.headers['X-Cache'] == 'SEMANTIC-HIT'
+        assert json.loads(response.data)['response'] == 'X does Y'
+        key = server.cache_key('llama2', [{'role': 'user', 'content': 'What does X do'}])
+        deadline = time.monotonic() + 5
+        while server.get_cached_response(key) is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert server.get_cached_response(key) == 'X does Y and Z'
+        assert mock_ollama_chat.call_count == 2
+    
+    def test_speculative_low_confidence_waits_for_inference(self, client, mock_ollama_chat, mock_ollama_embed, speculative, api_headers):
+        """Test that matches below the speculative threshold return the fresh inference."""
+        self._seed(client, api_headers, mock_ollama_chat, mock_ollama_embed)
+        mock_ollama_chat.return_value = {'message': {'content': 'Fresh answer'}}
+        mock_ollama_embed.return_value = {'embeddings': [[1.0, 0.3]]}
+        
+        response = self._post(client, api_headers, 'Explain X')
+        
+        assert response.headers['X-Cache'] == 'MISS'
+        assert json.loads(response.data)['response'] == 'Fresh answer'
+    
+    def test_embedding_failure_falls_back_to_ollama(self, client, mock_ollama_chat, mock_ollama_embed, semantic_cache, api_headers):
+        """Test that a failing embedding model does not fail the request."""
+        mock_ollama_chat.return_value = {'message': {'content': 'Reply'}}
+        mock_ollama_embed.side_effect = Exception('model not found')
+        
+        response = self._post(client, api_headers, 'Hello')
+        
+        assert response.status_code == 200
+        assert json.loads(response.data)['response'] == 'Reply'
+
+
+class TestRequestCoalescing:
+    """Tests for sharing one Ollama call between identical concurrent requests."""
+    
+    @pytest.fixture
+    def follower_waiting(self, monkeypatch):
+        """Patch Future so tests can tell when a second caller is waiting on it."""
+        import threading
+        import server
+        waiting = threading.Event()
+        
+        class SignallingFuture(server.Future):
+            def __init__(self):
+                super().__init__()
+                self.waiters = 0
+            
+            def result(self, timeout=None):
+                # The leader waits on the same Future, so signal on the second caller
+                self.waiters += 1
+                if self.waiters >= 2:
+                    waiting.set()
+                return super().result(timeout)
+        
+        monkeypatch.setattr(server, 'Future', SignallingFuture)
+        return waiting
+    
+    def _run_concurrently(self, mock_ollama_chat, follower_waiting, leader_effect):
+        import threading
+        from server import start_chat
+        started = threading.Event()
+        
+        def slow_chat(**kwargs):
+            started.set()
+            assert follower_waiting.wait(timeout=5)
+            return leader_effect()
+        
+        mock_ollama_chat.side_effect = slow_chat
+        results = {}
+        
+        def call(name):
+            try:
+                results[name] = start_chat('key', 'llama2', [{'role': 'user', 'content': 'Hi'}]).result()
+            except Exception as e:
+                results[name] = e
+        
+        leader = threading.Thread(target=call, args=('leader',))
+        leader.start()
+        assert started.wait(timeout=5)
+        follower = threading.Thread(target=call, args=('follower',))
+        follower.start()
+        leader.join(timeout=5)
+        follower.join(timeout=5)
+        return results
+    
+    def test_concurrent_identical_requests_share_one_call(self, mock_ollama_chat, follower_waiting):
+        """Test that a request arriving mid-flight reuses the leader's result."""
+        results = self._run_concurrently(
+            mock_ollama_chat, follower_waiting,
+            lambda: {'message': {'content': 'Shared'}}
+        )
+        
+        assert results == {'leader': 'Shared', 'follower': 'Shared'}
+        mock_ollama_chat.assert_called_once()
+    
+    def test_leader_error_is_shared(self, mock_ollama_chat, follower_waiting):
+        """Test that waiting callers see the leader's exception."""
+        def fail():
+            raise Exception('boom')
+        
+        results = self._run_concurrently(mock_ollama_chat, follower_waiting, fail)
+        
+        assert str(results['leader']) == 'boom'
+        assert str(results['follower']) == 'boom'
+        mock_ollama_chat.assert_called_once()
+    
+    def test_inflight_entry_removed_after_call(self, mock_ollama_chat):
+        """Test that sequential calls are not coalesced."""
+        import server
+        mock_ollama_chat.return_value = {'message': {'content': 'Reply'}}
+        
+        server.start_chat('key', 'llama2', []).result()
+        server.start_chat('key', 'llama2', []).result()
+        
+        assert server._inflight == {}
+        assert mock_ollama_chat.call_count == 2
+    
+    def test_response_cached_before_leaving_inflight(self, mock_ollama_chat, monkeypatch):
+        """Test that the exact cache is written while the call is still in flight."""
+        import server
+        mock_ollama_chat.return_value = {'message': {'content': 'Reply'}}
+        seen = []
+        set_cached_response = server.set_cached_response
+        
+        def recording_set(key, content):
+            seen.append(key in server._inflight)
+            set_cached_response(key, content)
+        
+        monkeypatch.setattr(server, 'set_cached_response', recording_set)
+        
+        assert server.start_chat('key', 'llama2', []).result() == 'Reply'
+        assert seen == [True]
+        assert server.get_cached_response('key') == 'Reply'
+        assert server._inflight == {}
+    
+    def test_no_cache_call_not_stored(self, mock_ollama_chat):
+        """Test that use_cache=False leaves the exact cache untouched."""
+        import server
+        mock_ollama_chat.return_value = {'message': {'content': 'Reply'}}
+        
+        server.start_chat('key', 'llama2', [], use_cache=False).result()
+        
+        assert server.get_cached_response('key') is None
+
 
 class TestModelsEndpoint:
     """Tests for the /api/v1/models endpoint."""
@@ -417,6 +1069,83 @@ class TestModelsEndpoint:
         assert json_data['count'] == 1
         assert len(json_data['models']) == 1
         assert json_data['models'][0] == 'llama2'
+    
+    def test_get_models_null_models_key(self, client, mock_ollama_list, api_headers):
+        """Test when Ollama returns models: null."""
+        mock_ollama_list.return_value = {'models': None}
+        
+        response = client.get('/api/v1/models', headers=api_headers)
+        
+        assert response.status_code == 200
+        json_data = json.loads(response.data)
+        assert json_data['models'] == []
+        assert json_data['count'] == 0
+    
+    def test_cached_models_are_immutable(self, mock_ollama_list):
+        """Test that the cached models list cannot be modified by callers."""
+        import server
+        mock_model = MagicMock()
+        mock_model.model = 'llama2'
+        mock_ollama_list.return_value = {'models': [mock_model]}
+        
+        models, _ = server.list_models()
+        
+        assert models == ('llama2',)
+    
+    def test_get_models_cached(self, client, mock_ollama_list, api_headers):
+        """Test that repeated requests within the TTL reuse one ollama list call."""
+        mock_model = MagicMock()
+        mock_model.model = 'llama2'
+        mock_ollama_list.return_value = {'models': [mock_model]}
+        
+        client.get('/api/v1/models', headers=api_headers)
+        response = client.get('/api/v1/models', headers=api_headers)
+        
+        assert response.status_code == 200
+        assert json.loads(response.data)['models'] == ['llama2']
+        mock_ollama_list.assert_called_once()
+    
+    def test_get_models_cache_expires(self, client, mock_ollama_list, api_headers, monkeypatch):
+        """Test that the models list is refreshed after MODELS_CACHE_TTL."""
+        import server
+        monkeypatch.setattr(server, 'MODELS_CACHE_TTL', 0)
+        mock_ollama_list.return_value = {'models': []}
+        
+        client.get('/api/v1/models', headers=api_headers)
+        client.get('/api/v1/models', headers=api_headers)
+        
+        assert mock_ollama_list.call_count == 2
+    
+    def test_get_models_errors_not_cached(self, client, mock_ollama_list, api_headers):
+        """Test that a failed ollama list call is retried on the next request."""
+        mock_ollama_list.side_effect = [Exception('Connection error'), {'models': []}]
+        
+        assert client.get('/api/v1/models', headers=api_headers).status_code == 500
+        assert client.get('/api/v1/models', headers=api_headers).status_code == 200
+    
+    def test_get_models_etag_not_modified(self, client, mock_ollama_list, api_headers):
+        """Test that a matching If-None-Match returns 304 with an empty body."""
+        mock_model = MagicMock()
+        mock_model.model = 'llama2'
+        mock_ollama_list.return_value = {'models': [mock_model]}
+        
+        first = client.get('/api/v1/models', headers=api_headers)
+        etag = first.headers['ETag']
+        second = client.get('/api/v1/models', headers={**api_headers, 'If-None-Match': etag})
+        
+        assert etag
+        assert second.status_code == 304
+        assert second.data == b''
+        assert second.headers['ETag'] == etag
+    
+    def test_get_models_etag_changes_with_models(self, client, mock_ollama_list, api_headers):
+        """Test that a stale If-None-Match gets the full list."""
+        mock_ollama_list.return_value = {'models': []}
+        
+        response = client.get('/api/v1/models', headers={**api_headers, 'If-None-Match': '"stale"'})
+        
+        assert response.status_code == 200
+        assert json.loads(response.data)['models'] == []
 
 
 class TestServerConfiguration:
@@ -427,11 +1156,42 @@ class TestServerConfiguration:
         from server import OLLAMA_HOST
         assert OLLAMA_HOST == "http://localhost:11434"
     
+    def test_ollama_client_is_shared(self):
+        """Test that a single pooled Ollama client is created at import."""
+        import ollama
+        from server import OLLAMA_HOST, ollama_client
+        assert isinstance(ollama_client, ollama.Client)
+        assert str(ollama_client._client.base_url).startswith(OLLAMA_HOST)
+    
     def test_app_instance_exists(self):
         """Test that Flask app instance exists."""
         from server import app
         assert isinstance(app, Flask)
     
+    def test_json_provider_uses_orjson(self):
+        """Test that the app serializes and parses JSON with orjson."""
+        from server import ORJSONProvider, app
+        assert isinstance(app.json, ORJSONProvider)
+        with app.app_context():
+            response = jsonify({"text": "Hello 世界"})
+            assert response.mimetype == 'application/json'
+            assert json.loads(response.data) == {"text": "Hello 世界"}
+            assert app.json.loads('{"a": [1, 2]}') == {"a": [1, 2]}
+    
+    def test_json_provider_matches_flask_output(self):
+        """Test that orjson output keeps Flask's sorted keys, non-string keys and date format."""
+        from datetime import datetime, timezone
+        from server import app
+        with app.app_context():
+            assert jsonify({"b": 1, "a": 2}).data == b'{"a":2,"b":1}\n'
+            assert jsonify({1: "a", 2: "b"}).data == b'{"1":"a","2":"b"}\n'
+            assert app.json.dumps({"b": 1, "a": 2}) == '{"a":2,"b":1}'
+            assert app.json.dumps({"b": 1, "a": 2}, sort_keys=False) == '{"b":1,"a":2}'
+            assert app.json.dumps({1: "a"}) == '{"1":"a"}'
+            moment = datetime(2024, 1, 1, tzinfo=timezone.utc)
+            assert app.json.dumps({"t": moment}) == '{"t":"Mon, 01 Jan 2024 00:00:00 GMT"}'
+            assert jsonify(t=moment).data == b'{"t":"Mon, 01 Jan 2024 00:00:00 GMT"}\n'
+    
     @patch.dict(os.environ, {'PORT': '8080', 'DEBUG': 'False'})
     def test_run_server_port_config(self):
         """Test that run_server reads PORT from environment."""
@@ -447,6 +1207,17 @@ class TestServerConfiguration:
         from server import run_server
         assert callable(run_server)
 
+    
+    @patch.dict(os.environ, {'PORT': '8080'})
+    def test_gunicorn_config(self):
+        """Test that the gunicorn config binds PORT and uses gevent workers."""
+        import runpy
+        config = runpy.run_path(os.path.join(os.path.dirname(__file__), '..', 'gunicorn.conf.py'))
+        assert config['bind'] == '0.0.0.0:8080'
+        assert config['worker_class'] == 'gevent'
+        assert config['workers'] == 1
+        assert config['worker_connections'] == 1000
+
 
 class TestEdgeCases:
     """Tests for edge cases and boundary conditions."""
@@ -476,6 +1247,27 @@ class TestEdgeCases:
         call_args = mock_ollama_chat.call_args
         assert call_args[1]['messages'][0]['content'] == long_prompt
     
+    def test_long_prompt_scheduled_as_long_prompt(self, client, mock_ollama_chat, api_headers):
+        """Test that prompts above LONG_PROMPT_TOKENS are flagged to the scheduler."""
+        import server
+        mock_ollama_chat.return_value = {'message': {'content': 'Response'}}
+        
+        with patch.object(server.scheduler, 'submit', wraps=server.scheduler.submit) as submit:
+            client.post(
+                '/api/v1/response',
+                data=json.dumps({'prompt': 'A' * 10000, 'model': 'llama2'}),
+                content_type='application/json',
+                headers=api_headers
+            )
+            client.post(
+                '/api/v1/response',
+                data=json.dumps({'prompt': 'Hello', 'model': 'llama2'}),
+                content_type='application/json',
+                headers=api_headers
+            )
+        
+        assert [c.args[3] for c in submit.call_args_list] == [True, False]
+    
     def test_response_with_special_characters(self, client, mock_ollama_chat, api_headers):
         """Test handling of special characters in prompt."""
         mock_ollama_chat.return_value = {
@@ -526,6 +1318,57 @@ class TestEdgeCases:
         call_args = mock_ollama_chat.call_args
         assert call_args[1]['messages'][0]['content'] == unicode_prompt
     
+    def test_oversized_body_rejected(self, client, mock_ollama_chat, api_headers, monkeypatch):
+        """Test that a body above the endpoint limit gets 413 without reaching Ollama."""
+        import server
+        monkeypatch.setitem(server.BODY_LIMITS, 'get_response', 100)
+        data = {
+            'prompt': 'A' * 200,
+            'model': 'llama2'
+        }
+        
+        response = client.post(
+            '/api/v1/response',
+            data=json.dumps(data),
+            content_type='application/json',
+            headers=api_headers
+        )
+        
+        assert response.status_code == 413
+        assert 'too large' in json.loads(response.data)['error'].lower()
+        mock_ollama_chat.assert_not_called()
+    
+    def test_body_above_max_content_length_rejected(self, client, api_headers, monkeypatch):
+        """Test that Flask's global MAX_CONTENT_LENGTH returns a JSON 413."""
+        import server
+        monkeypatch.setitem(server.BODY_LIMITS, 'get_response', 10 * 1024 * 1024)
+        monkeypatch.setitem(server.app.config, 'MAX_CONTENT_LENGTH', 100)
+        data = {
+            'prompt': 'A' * 200,
+            'model': 'llama2'
+        }
+        
+        response = client.post(
+            '/api/v1/response',
+            data=json.dumps(data),
+            content_type='application/json',
+            headers=api_headers
+        )
+        
+        assert response.status_code == 413
+        assert 'error' in json.loads(response.data)
+    
+    def test_body_on_bodyless_endpoint_rejected(self, client, api_headers):
+        """Test that endpoints without a body limit refuse request bodies."""
+        response = client.get('/api/v1/models', data='x' * 10, headers=api_headers)
+        assert response.status_code == 413
+    
+    def test_default_body_limit(self):
+        """Test that the response endpoint accepts bodies up to 1 MB by default."""
+        import server
+        assert server.app.config['MAX_CONTENT_LENGTH'] == 1024 * 1024
+        assert server.BODY_LIMITS['get_response'] == 1024 * 1024
+    
     def test_models_endpoint_http_method_not_allowed(self, client):
         """Test that POST is not allowed on /api/v1/models."""
         response = client.post('/api/v1/models')